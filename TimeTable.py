@@ -1,8 +1,9 @@
-from copy import deepcopy
-import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
 
 WEEK_DAYS = ['Sun', 'Mon', 'Tue', 'Wed', 'Thu', 'Sat']
 WEEK_DAYS_FULL = ['Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Saturday']
+DAY_INDEX = {day: i for i, day in enumerate(WEEK_DAYS)} # the index of each day in WEEK_DAYS
 
 class ScheduleError(Exception):
     pass
@@ -11,16 +12,18 @@ class DuplicateSubjectError(ValueError):
     pass
 
 class Event:
+    __slots__ = ('name', 'day', 'day_idx', 'periods', 'mask')
+
     def __init__(self, name: str, day: str, *periods: int):
         # handle name
-        if type(name) != str:
+        if not isinstance(name, str):
             raise TypeError("Event name must be a string")
         self.name = str(name)
 
         # handle invalid day input
-        if type(day) != str:
+        if not isinstance(day, str):
             raise TypeError("Day must be a string")
-        if day not in WEEK_DAYS:
+        if day not in DAY_INDEX:
             raise ValueError("Invalid day for an Event")
 
         # handle schedule
@@ -28,66 +31,89 @@ class Event:
             raise ScheduleError("Event must have at least one period")
 
         for period in periods:
-            if type(period) != int:
+            if not isinstance(period, int):
                 raise TypeError("All periods must be int") # handle invalid period input
+            if period < 0:
+                raise ValueError("Periods can't be negative")
+
+        # the event happens on one day, in each of its periods
+        self.day = day
+        self.day_idx = DAY_INDEX[day] # the index of the day in WEEK_DAYS, used to index Table cells
+        self.periods = tuple(periods)
+
+        # the periods as an integer with the bit (period * len(WEEK_DAYS) + day index) set for each of them,
+        # groups and tables combine these so that finding an overlap is a single AND;
+        # None if a period is repeated, the event then overlaps itself and can't be placed in a Table
+        self.mask = 0
+        for period in periods:
+            bit = 1 << (period * len(WEEK_DAYS) + self.day_idx)
+            if self.mask & bit:
+                self.mask = None
+                break
+            self.mask |= bit
 
-        # create list: days with the same size of periods
-        days = []
-        for i in range(len(periods)):
-            days.append(day)
-
-        # zip days with periods in a list: schedule
-        self.schedule = list(zip(days, periods))
+    # (day, period) pairs for every period of the event
+    @property
+    def schedule(self):
+        return tuple((self.day, period) for period in self.periods)
 
     def __repr__(self):
-        day = self.schedule[0][0]
-        periods = [self.schedule[i][1] for i in range(len(self.schedule))]
-        text = f"Event('{self.name}', '{self.schedule[0][0]}'"
-        for period in periods:
-            text += f", {period}"
-        text += ")"
-        return text
+        periods = ''.join([f", {period}" for period in self.periods])
+        return f"Event('{self.name}', '{self.day}'{periods})"
 
     def __str__(self):
-        day = self.schedule[0][0]
-        periods = [self.schedule[i][1] for i in range(len(self.schedule))]
-        return f"{self.name} on {WEEK_DAYS_FULL[WEEK_DAYS.index(day)]}, periods: {periods}"
+        return f"{self.name} on {WEEK_DAYS_FULL[self.day_idx]}, periods: {list(self.periods)}"
 
 class Group:
+    __slots__ = ('name', 'events', 'mask')
+
     def __init__(self, name: str, *events: Event):
         # handle name
-        if type(name) != str:
+        if not isinstance(name, str):
             raise TypeError("Group name must be a string")
         self.name = str(name)
 
         # handle events
         self.events = []
+        self.mask = 0 # periods of all events of the group, None if they overlap so the group can't be placed
         for event in events:
-            if type(event) != Event:
+            if not isinstance(event, Event):
                 raise TypeError("All events must be of type Event")
             self.events.append(event)
+            if self.mask is None or event.mask is None or self.mask & event.mask:
+                self.mask = None
+            else:
+                self.mask |= event.mask
 
     def __repr__(self):
-        text = f"Group('{self.name}'"
-        for event in self.events:
-            text += f", {event.__repr__()}"
-        text += ")"
-        return text
+        events = ''.join([f", {event.__repr__()}" for event in self.events])
+        return f"Group('{self.name}'{events})"
 
     def __str__(self):
         return '\n'.join([event.__str__() for event in self.events])
 
+# the periods of groups placed together, None if they overlap so they can't be placed
+def _groups_mask(groups) -> int:
+    mask = 0
+    for group in groups:
+        if group.mask is None or mask & group.mask:
+            return None
+        mask |= group.mask
+    return mask
+
 class Subject:
+    __slots__ = ('name', 'cred_hours', 'groups', '_group_by_name', '_group_options')
+
     def __init__(self, name: str, cred_hours: int, *groups: Group):
         # handle name
-        if type(name) != str:
+        if not isinstance(name, str):
             raise TypeError("Subject name must be a string")
         self.name = name
 
         # handle cred_hours
-        if type(cred_hours) == int:
+        if isinstance(cred_hours, int):
             self.cred_hours = cred_hours
-        elif type(cred_hours) == float:
+        elif isinstance(cred_hours, float):
             self.cred_hours = int(cred_hours)
             print("Warning: cred_hours was converted from float to int")
         else:
@@ -95,113 +121,621 @@ class Subject:
 
         # handle groups
         self.groups = []
+        self._group_by_name = {} # all groups with each name, for lookups by name
         for group in groups:
-            if type(group) != Group:
+            if not isinstance(group, Group):
                 raise TypeError("All groups must be of type Group")
             self.groups += [group]
+            self._group_by_name[group.name] = self._group_by_name.get(group.name, ()) + (group,)
+        # the (groups, mask) of every group name in the order build_tables tries them, sorted by name once here
+        # instead of on every search; like add_subject, choosing a name places all groups with that name
+        self._group_options = tuple((groups, _groups_mask(groups))
+                                    for _, groups in sorted(self._group_by_name.items(), key=lambda item: item[0]))
 
 
 
     def __str__(self):
-        text = f"""Subject:
+        parts = [f"""Subject:
 \tName: {self.name}
-\tCredit Hours: {self.cred_hours}\n"""
+\tCredit Hours: {self.cred_hours}\n"""]
 
         for group in self.groups:
-            text += f"\tSchedule ({group.name}):\n"
+            parts.append(f"\tSchedule ({group.name}):\n")
             group_lines = group.__str__().split('\n')
             for line in group_lines:
                 if line:
-                    text += f"\t\t{line}\n" # Adding 8 spaces for alignment
-        return text
+                    parts.append(f"\t\t{line}\n") # Adding 8 spaces for alignment
+        return ''.join(parts)
 
     def __repr__(self):
-        text = f"Subject('{self.name}', {self.cred_hours}"
-        for group in self.groups:
-            text += f", {group.__repr__()}"
-        text += ")"
-        return text
+        groups = ''.join([f", {group.__repr__()}" for group in self.groups])
+        return f"Subject('{self.name}', {self.cred_hours}{groups})"
+
+class _TableDay:
+    # the periods of one day of a Table, a list-like view of its part of Table._cells;
+    # writes through it keep Table.occ_mask in sync, so the table's conflict checks see them
+    __slots__ = ('_table', '_day_idx', '_start', '_size')
+
+    def __init__(self, table: 'Table', day_idx: int):
+        self._table = table
+        self._day_idx = day_idx
+        self._start = day_idx * table.size
+        self._size = table.size
+
+    def _period(self, period: int) -> int:
+        if period < 0:
+            period += self._size
+        if not 0 <= period < self._size:
+            raise IndexError("period out of range")
+        return period
+
+    def __getitem__(self, period: int):
+        if isinstance(period, slice):
+            return self._table._cells[self._start:self._start + self._size][period]
+        return self._table._cells[self._start + self._period(period)]
+
+    def __setitem__(self, period: int, item):
+        period = self._period(period)
+        self._table._cells[self._start + period] = item
+        bit = 1 << (period * len(WEEK_DAYS) + self._day_idx)
+        if item is None:
+            self._table.occ_mask &= ~bit
+        else:
+            self._table.occ_mask |= bit
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        return iter(self._table._cells[self._start:self._start + self._size])
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return repr(list(self))
 
 class Table(dict):
+    # the days are the dictionary items, everything else lives in slots so a Table has no instance __dict__
+    __slots__ = ('subjects', 'groups', 'cred_hours', 'occ_mask', '_subjects_set', '_placed_groups', 'size', '_cells')
+
     def __init__(self, size: int = 12):
         # initialize empty attributes
         self.subjects = []
         self.groups = []
         self.cred_hours = int() # total cerdit hours of all subjects in the table
-        # handle dictionary properties
-        day_schedules = [[None for i in range(size)] for i in range(len(WEEK_DAYS))] # a list of None values with a default size of 12
+        self.occ_mask = 0 # periods of all non-empty cells, in the layout of Event.mask
+        self._subjects_set = set() # id() of every subject in self.subjects
+        self._placed_groups = [] # the Group objects each subject in self.subjects was placed with
+        # all cells of the table in one flat list, the periods of WEEK_DAYS[i] are at [i * size, (i + 1) * size)
+        self.size = size
+        self._cells = [None] * (len(WEEK_DAYS) * size)
+        # handle dictionary properties, each day maps to a view of its cells
         super().__init__() # initialize dictionary behavior
         for i in range(len(WEEK_DAYS)):
-            self[WEEK_DAYS[i]] = day_schedules[i]
+            self[WEEK_DAYS[i]] = _TableDay(self, i)
 
+    # self.cred_hours is kept up to date by add_subject and remove_subject
     def get_cred_hours(self):
-        self.cred_hours = 0
-        for subject in self.subjects:
-            self.cred_hours += subject.cred_hours
         return self.cred_hours
 
-    # add the schedule of a group of a subject to the table, raise an error if an overlap exists
+    # add the schedule of a group of a subject to the table, raise an error if an overlap exists;
+    # a subject with several groups of that name gets all of them
     def add_subject(self, subject: Subject, group_name: str):
         # handle invalid user input
-        if type(subject) != Subject:
+        if not isinstance(subject, Subject):
             raise TypeError("Subject must be of type Subject")
-        if type(group_name) != str:
+        if not isinstance(group_name, str):
             raise TypeError("Group name must be a string")
-        if group_name not in [group.name for group in subject.groups]:
+        groups = subject._group_by_name.get(group_name)
+        if groups is None:
             raise ValueError(f"No group named '{group_name}' was found")
-        if subject in self.subjects:
+        if id(subject) in self._subjects_set:
             raise DuplicateSubjectError(f"Subject '{subject.name}' is already in the table")
+        # check all periods of the groups at once before writing any, so a conflict leaves the table unchanged
+        mask = _groups_mask(groups)
+        if mask is None or self.occ_mask & mask:
+            raise ScheduleError("There is already a subject in this period")
+        self._add_subject_fast(subject, groups)
+
+    # add_subject without any checks, for callers that already know the groups fit (like build_tables)
+    def _add_subject_fast(self, subject: Subject, groups: tuple):
+        mask = 0
+        for group in groups:
+            mask |= group.mask
+        # a period past the end of the day would land in the next day of self._cells
+        if mask >> (self.size * len(WEEK_DAYS)):
+            raise IndexError("The group has a period outside the table")
         # accessing group schedule
-        found_group = False
-        for group in subject.groups:
-            if group.name == group_name:
-                found_group = True # Mark that the group was found
-                for event in group.events:
-                    for tup in event.schedule:
-                        day = tup[0]
-                        period = tup[1]
-                        if self[day][period] != None:
-                            raise ScheduleError("There is already a subject in this period")
-                        # each cell in the table has a tuple containing the subject, the group name and the event name
-                        self[day][period] = (subject, group.name, event.name)
-        if not found_group:
-            raise ValueError(f"There is no group with this name '{group_name}' for subject {subject.name}")
-        # add the subject to self.subjects
+        for group in groups:
+            for event in group.events:
+                # each cell in the table has a tuple containing the subject, the group name and the event name
+                item = (subject, group.name, event.name)
+                day_start = event.day_idx * self.size
+                for period in event.periods:
+                    self._cells[day_start + period] = item
+        self.occ_mask |= mask
+        # add the subject to self.subjects and remember which groups it was placed with
         self.subjects.append(subject)
-        self.cred_hours = self.get_cred_hours()
+        self.groups.append(groups[0].name)
+        self._placed_groups.append(groups)
+        self._subjects_set.add(id(subject))
+        self.cred_hours += subject.cred_hours
+
+    # remove a subject added by add_subject, clearing the periods of its groups
+    def remove_subject(self, subject: Subject):
+        if id(subject) not in self._subjects_set:
+            raise ValueError(f"Subject '{subject.name}' is not in the table")
+        index = self.subjects.index(subject)
+        groups = self._placed_groups.pop(index)
+        self.groups.pop(index)
+        self.subjects.pop(index)
+        self._subjects_set.discard(id(subject))
+        for group in groups:
+            self.occ_mask &= ~group.mask
+            for event in group.events:
+                day_start = event.day_idx * self.size
+                for period in event.periods:
+                    self._cells[day_start + period] = None
+        self.cred_hours -= subject.cred_hours
+
+    # a new Table with the same subjects placed in the same groups
+    def copy(self):
+        table = Table(self.size)
+        for subject, groups in zip(self.subjects, self._placed_groups):
+            table._add_subject_fast(subject, groups)
+        return table
 
     def merge(self, other: 'Table'):
-        if type(other) != Table:
+        if not isinstance(other, Table):
             raise TypeError("You can only merge a Table to another Table")
-        for key, value in other.items(): # where each key-value pair represents a day's schedule
-            for item in value:
-                if self[key][value.index(item)] != None:
-                    raise ScheduleError("There is already a subject in this period")
-                self[key][value.index(item)] = item
+        # one AND finds any overlap before anything is copied
+        if self.occ_mask & other.occ_mask:
+            raise ScheduleError("There is already a subject in this period")
+        if other.occ_mask >> (self.size * len(WEEK_DAYS)):
+            raise IndexError("The other table has a period outside this table")
+        for subject in other.subjects:
+            if id(subject) in self._subjects_set:
+                raise DuplicateSubjectError(f"Subject '{subject.name}' is already in the table")
+        for index, item in enumerate(other._cells):
+            if item is not None:
+                day_index, period = divmod(index, other.size)
+                self._cells[day_index * self.size + period] = item
+        self.occ_mask |= other.occ_mask
+        # the subjects of other are now in this table too
+        self.subjects.extend(other.subjects)
+        self.groups.extend(other.groups)
+        self._placed_groups.extend(other._placed_groups)
+        self._subjects_set.update(other._subjects_set)
+        self.cred_hours += other.cred_hours
 
     def __iadd__(self, other: 'Table'):
-        if type(other) == Subject:
-            self.merge(other)
+        self.merge(other) # raises TypeError if other isn't a Table
         return self
 
     def __repr__(self):
         return "Table()"
 
     def __str__(self):
-        text = "Schedule Table:\n"
+        parts = ["Schedule Table:\n"]
         for day_index, day in enumerate(WEEK_DAYS):
             day_full_name = WEEK_DAYS_FULL[day_index]
-            text += f"  {day_full_name}:\n"
+            parts.append(f"  {day_full_name}:\n")
             day_has_events = False
             for period_index, item in enumerate(self[day]):
-                if item:
+                if item is not None:
                     subject_obj, group_name, event_name = item
-                    text += f"    Period {period_index}: {subject_obj.name} ({group_name}) - {event_name}\n"
+                    parts.append(f"    Period {period_index}: {subject_obj.name} ({group_name}) - {event_name}\n")
                     day_has_events = True
             if not day_has_events:
-                text += "    No events scheduled\n"
-        text += f"Total Credit Hours: {self.get_cred_hours()}\n"
-        return text
+                parts.append("    No events scheduled\n")
+        parts.append(f"Total Credit Hours: {self.cred_hours}\n")
+        return ''.join(parts)
+
+# in the worker processes of build_tables: the number of tables found by all of them together,
+# so every worker can stop as soon as enough were found anywhere
+_found_counter = None
+
+def _init_search_worker(found_counter):
+    global _found_counter
+    _found_counter = found_counter
+
+def _incompatible_subjects(group_masks: list) -> list:
+    """
+    Finds the pairs of subjects that can never be in the same table,
+    because every group of one of them shares a period with every group of the other.
+
+    Returns:
+        For every subject, an integer with bit j set if it can't be placed together with subject j.
+    """
+    incompatible = [0] * len(group_masks)
+    for i in range(len(group_masks)):
+        for j in range(i + 1, len(group_masks)):
+            if all(mask_i & mask_j for mask_i in group_masks[i] for mask_j in group_masks[j]):
+                incompatible[i] |= 1 << j
+                incompatible[j] |= 1 << i
+    return incompatible
+
+def _place_subject(group_masks: list, placements: tuple, occupied: int, subject_idx: int):
+    """
+    Places subject_idx together with the subjects of placements, in the first groups that fit,
+    comparing the groups subject by subject in the order they are tried.
+    placements must already be the first way to place its own subjects, then every way to place all of them
+    comes after it, and the search starts there instead of from scratch.
+
+    Returns:
+        A tuple (placements, occupied mask) with subject_idx added, or None if the subjects can't be placed together.
+    """
+    # usually a group of the new subject fits with the others as they are
+    for group_idx, mask in enumerate(group_masks[subject_idx]):
+        if not occupied & mask:
+            return placements + ((subject_idx, group_idx),), occupied | mask
+    subjects = [s for s, _ in placements] + [subject_idx]
+    chosen = [g for _, g in placements] + [-1]
+    # occupied_before[level] has the periods of the subjects before that level
+    occupied_before = [0]
+    for s, g in placements:
+        occupied_before.append(occupied_before[-1] | group_masks[s][g])
+    occupied_before.append(0)
+    # none of the groups of the new subject fit, so change the groups of the subjects before it, last one first
+    level = len(placements) - 1
+    while level >= 0:
+        masks = group_masks[subjects[level]]
+        group_idx = chosen[level] + 1
+        while group_idx < len(masks) and occupied_before[level] & masks[group_idx]:
+            group_idx += 1
+        if group_idx == len(masks):
+            level -= 1
+            continue
+        chosen[level] = group_idx
+        occupied_before[level + 1] = occupied_before[level] | masks[group_idx]
+        level += 1
+        if level == len(subjects):
+            return tuple(zip(subjects, chosen)), occupied_before[level]
+        chosen[level] = -1
+    return None
+
+def _search(
+    group_masks: list,
+    incompatible: list,
+    cred_hours: list,
+    num_forced: int,
+    min_subjects: int,
+    max_subjects: int,
+    min_cred_hours: int,
+    max_cred_hours: int,
+    limit: int,
+    start: tuple = (0, 0, 0, ()),
+    split_depth: int = None,
+) -> tuple:
+    """
+    The depth-first search behind build_tables. It works on plain data only,
+    so it can run in a worker process as well.
+    Every subject is either included or skipped, so each set of subjects is found at most once,
+    in the first groups that fit together (see _place_subject).
+
+    Args:
+        group_masks: For every subject, the masks of its groups in the order they are tried.
+        incompatible: The subjects that can't be placed together, see _incompatible_subjects.
+        cred_hours: The credit hours of every subject.
+        num_forced: The first num_forced subjects are always placed, the others may be skipped.
+        min_subjects, max_subjects, min_cred_hours, max_cred_hours: The limits from build_tables.
+        limit: Stop after this many solutions.
+        start: The node to search below, as (subject index, occupied mask, credit hours, placements),
+               where placements is the first way to place its subjects as in _place_subject.
+        split_depth: If given, nodes at this subject index are not searched but returned in the frontier.
+
+    Returns:
+        A tuple (solutions, frontier). Each solution is a tuple of (subject index, group index)
+        placements, and the frontier is a list of nodes in the format of start.
+    """
+    num_subjects = len(cred_hours)
+    # remaining_cred_hours[i] is the total credit hours of subjects i and after
+    remaining_cred_hours = [0] * (num_subjects + 1)
+    for i in range(num_subjects - 1, -1, -1):
+        remaining_cred_hours[i] = remaining_cred_hours[i + 1] + cred_hours[i]
+
+    # a subject incompatible with one already placed is skipped without trying its groups
+    start_blocked = 0
+    for subject_idx, _ in start[3]:
+        start_blocked |= incompatible[subject_idx]
+
+    solutions = []
+    frontier = []
+    # the shared count is read without its lock, a slightly stale value only delays stopping
+    found = _found_counter.get_obj() if _found_counter is not None else None
+
+    def _dfs(idx, occupied, partial_cred_hours, blocked, placements):
+        # placements has the (subject index, group index) pairs of the subjects included so far,
+        # their periods are set in occupied, their credit hours sum to partial_cred_hours
+        # and blocked has the subjects incompatible with them; decide on subject idx
+        if len(solutions) >= limit or (found is not None and found.value >= limit):
+            return
+        # bound: the minimums can't be reached even if all remaining subjects are placed
+        if len(placements) + (num_subjects - idx) < min_subjects:
+            return
+        if partial_cred_hours + remaining_cred_hours[idx] < min_cred_hours:
+            return
+        if idx == num_subjects:
+            solutions.append(placements)
+            if found is not None:
+                with _found_counter.get_lock():
+                    found.value += 1
+            return
+        if idx == split_depth:
+            frontier.append((idx, occupied, partial_cred_hours, placements))
+            return
+
+        # (a) include the subject, unless that already exceeds one of the maximums
+        # or none of its groups can fit with a subject already placed
+        next_cred_hours = partial_cred_hours + cred_hours[idx]
+        if len(placements) < max_subjects and next_cred_hours <= max_cred_hours and not (blocked >> idx) & 1:
+            placed = _place_subject(group_masks, placements, occupied, idx)
+            if placed is not None:
+                _dfs(idx + 1, placed[1], next_cred_hours, blocked | incompatible[idx], placed[0])
+                if len(solutions) >= limit or (found is not None and found.value >= limit):
+                    return
+        # (b) skip the subject, forced subjects can't be skipped
+        if idx >= num_forced:
+            _dfs(idx + 1, occupied, partial_cred_hours, blocked, placements)
+
+    _dfs(start[0], start[1], start[2], start_blocked, tuple(start[3]))
+    return solutions, frontier
+
+# the jitted search is used when numba is installed, otherwise build_tables falls back to _search
+try:
+    import numpy as np
+    import numba
+    from numba import njit, prange, get_num_threads, set_num_threads
+except ImportError:
+    njit = None
+
+# the most solutions build_tables takes out of the jitted search at a time
+_SEARCH_CHUNK_ROWS = 4096
+
+# with fewer subjects than this the search takes milliseconds in plain Python, so build_tables runs _search
+# in a single process instead of compiling the jitted search (which takes seconds the first time) or starting workers
+_JIT_MIN_SUBJECTS = 20
+
+if njit is not None:
+    @njit(cache=True)
+    def _place_subject_jit(group_masks, num_groups, chosen, subject_idx, occupied):
+        """
+        _place_subject compiled with numba, for when no group of subject_idx fits with the others as they are.
+        chosen holds the groups of the subjects before subject_idx like a row of the out array of _search_jit,
+        the new groups are written to it and their periods to occupied.
+
+        Returns:
+            Whether the subjects can be placed together, chosen and occupied are only valid if they can.
+        """
+        num_words = group_masks.shape[2]
+        num_levels = 1
+        for i in range(subject_idx):
+            if chosen[i] >= 0:
+                num_levels += 1
+        subjects = np.empty(num_levels, np.int64)
+        level = 0
+        for i in range(subject_idx):
+            if chosen[i] >= 0:
+                subjects[level] = i
+                level += 1
+        subjects[num_levels - 1] = subject_idx
+        chosen[subject_idx] = -1
+        # occupied_before[level] has the periods of the subjects before that level
+        occupied_before = np.zeros((num_levels + 1, num_words), np.uint64)
+        for level in range(num_levels - 1):
+            for word in range(num_words):
+                occupied_before[level + 1, word] = occupied_before[level, word] | group_masks[subjects[level], chosen[subjects[level]], word]
+        # change the groups of the subjects before the new one, last one first
+        level = num_levels - 2
+        while level >= 0:
+            subject = subjects[level]
+            group = chosen[subject] + 1
+            while group < num_groups[subject]:
+                conflict = False
+                for word in range(num_words):
+                    if occupied_before[level, word] & group_masks[subject, group, word]:
+                        conflict = True
+                        break
+                if not conflict:
+                    break
+                group += 1
+            if group == num_groups[subject]:
+                chosen[subject] = -1
+                level -= 1
+                continue
+            chosen[subject] = group
+            for word in range(num_words):
+                occupied_before[level + 1, word] = occupied_before[level, word] | group_masks[subject, group, word]
+            level += 1
+            if level == num_levels:
+                occupied[:] = occupied_before[level, :]
+                return True
+            chosen[subjects[level]] = -1
+        return False
+
+    @njit(cache=True)
+    def _search_jit(group_masks, num_groups, incompatible, cred_hours, num_forced,
+                    min_subjects, max_subjects, min_cred_hours, max_cred_hours, out, found_total, branch, limit,
+                    position, occupied, blocked, partial_cred_hours, num_placed, choice, chosen):
+        """
+        _search compiled with numba, for the search of build_tables.
+        The recursion is unrolled into an explicit stack with one level per subject, kept in the state arrays
+        made by _new_search_state, so a search that stopped because out was full continues where it left off
+        when called again with the same state.
+
+        Args:
+            group_masks: uint64 array (subjects x max groups x words), the group masks split into 64 bit words.
+            num_groups: The number of groups of every subject.
+            incompatible: uint64 array (subjects x words), the result of _incompatible_subjects split into 64 bit words.
+            cred_hours: The credit hours of every subject.
+            num_forced, min_subjects, max_subjects, min_cred_hours, max_cred_hours: As in _search.
+            out: int64 array (rows x subjects) that receives the solutions, one row each,
+                 holding the index of the chosen group of every subject or -1 if it was skipped.
+            found_total: int64 array (branches), the number of solutions found so far below each node of the frontier
+                 the search is part of, found_total[branch] is counted up by this search. It stops once the nodes up to
+                 its own have found limit solutions together, since the solutions of later nodes come after theirs.
+            position, occupied, blocked, partial_cred_hours, num_placed, choice, chosen: The state of the search,
+                 see _new_search_state.
+
+        Returns:
+            The number of solutions written to out, less than its rows only if the search is done
+            or the limit was reached.
+        """
+        num_subjects = num_groups.shape[0]
+        num_words = group_masks.shape[2]
+        rows = out.shape[0]
+        remaining_cred_hours = np.zeros(num_subjects + 1, np.int64)
+        for i in range(num_subjects - 1, -1, -1):
+            remaining_cred_hours[i] = remaining_cred_hours[i + 1] + cred_hours[i]
+        found = 0
+
+        idx = position[0]
+        start_idx = position[1]
+        enough = False
+        while idx >= start_idx and found < rows and not enough:
+            if choice[idx] == -1:
+                # bound: the minimums can't be reached even if all remaining subjects are placed
+                if (num_placed[idx] + (num_subjects - idx) < min_subjects
+                        or partial_cred_hours[idx] + remaining_cred_hours[idx] < min_cred_hours):
+                    idx -= 1
+                    continue
+                if idx == num_subjects:
+                    out[found, :] = chosen[idx, :]
+                    found += 1
+                    found_total[branch] += 1
+                    # the other threads only ever count up, so reading a stale value just stops later
+                    total = 0
+                    for other in range(branch + 1):
+                        total += found_total[other]
+                    enough = total >= limit
+                    idx -= 1
+                    continue
+                choice[idx] = 0
+                # including the subject would exceed one of the maximums or none of its groups can fit
+                # with a subject already placed, only skipping is left
+                if (num_placed[idx] >= max_subjects
+                        or partial_cred_hours[idx] + cred_hours[idx] > max_cred_hours
+                        or (blocked[idx, idx // 64] >> np.uint64(idx % 64)) & np.uint64(1)):
+                    choice[idx] = 1
+
+            option = choice[idx]
+            choice[idx] = option + 1
+            chosen[idx + 1, :] = chosen[idx, :]
+            if option == 0:
+                # (a) include the subject in the first group that fits with the others as they are,
+                # or else change their groups as well
+                placed = False
+                for group in range(num_groups[idx]):
+                    conflict = False
+                    for word in range(num_words):
+                        if occupied[idx, word] & group_masks[idx, group, word]:
+                            conflict = True
+                            break
+                    if not conflict:
+                        for word in range(num_words):
+                            occupied[idx + 1, word] = occupied[idx, word] | group_masks[idx, group, word]
+                        chosen[idx + 1, idx] = group
+                        placed = True
+                        break
+                if not placed:
+                    placed = _place_subject_jit(group_masks, num_groups, chosen[idx + 1], idx, occupied[idx + 1])
+                if not placed:
+                    continue
+                partial_cred_hours[idx + 1] = partial_cred_hours[idx] + cred_hours[idx]
+                num_placed[idx + 1] = num_placed[idx] + 1
+                blocked[idx + 1, :] = blocked[idx, :] | incompatible[idx, :]
+            elif option == 1 and idx >= num_forced:
+                # (b) skip the subject, forced subjects can't be skipped
+                occupied[idx + 1, :] = occupied[idx, :]
+                partial_cred_hours[idx + 1] = partial_cred_hours[idx]
+                num_placed[idx + 1] = num_placed[idx]
+                blocked[idx + 1, :] = blocked[idx, :]
+            else:
+                # every option of this subject was tried, backtrack
+                choice[idx] = -1
+                idx -= 1
+                continue
+            choice[idx + 1] = -1
+            idx += 1
+        position[0] = idx
+        return found
+
+    @njit(cache=True, parallel=True)
+    def _search_jit_parallel(group_masks, num_groups, incompatible, cred_hours, num_forced,
+                             min_subjects, max_subjects, min_cred_hours, max_cred_hours, out, found, active,
+                             found_total, limit, position, occupied, blocked, partial_cred_hours, num_placed, choice, chosen):
+        """
+        Runs _search_jit below the active nodes of a frontier of _search, one thread per node at a time.
+        Each node writes to its own out[branch], found[branch] and state; only found_total is shared,
+        so the threads of later nodes stop as soon as the earlier ones found enough.
+
+        Args:
+            out: int64 array (branches x rows x subjects), the solutions of every node.
+            found: int64 array (branches), receives the number of solutions written to out by every node.
+            active: bool array (branches), the nodes to search.
+            position, occupied, blocked, partial_cred_hours, num_placed, choice, chosen: The state of
+                 the search below every node, see _new_search_state.
+            Others as in _search_jit.
+        """
+        for branch in prange(position.shape[0]):
+            if active[branch]:
+                found[branch] = _search_jit(group_masks, num_groups, incompatible, cred_hours, num_forced,
+                                            min_subjects, max_subjects, min_cred_hours, max_cred_hours,
+                                            out[branch], found_total, branch, limit,
+                                            position[branch], occupied[branch], blocked[branch],
+                                            partial_cred_hours[branch], num_placed[branch], choice[branch], chosen[branch])
+
+def _encode_search_args(group_masks: list, incompatible: list, cred_hours: list) -> tuple:
+    """
+    Converts the group masks, incompatible subjects and credit hours passed to _search into the arrays used by _search_jit.
+    The masks can be wider than 64 bits, so each is split into 64 bit words.
+    """
+    max_groups = max([len(masks) for masks in group_masks] + [1])
+    max_bits = max([mask.bit_length() for masks in group_masks for mask in masks] + [1])
+    num_words = (max_bits + 63) // 64
+    mask_array = np.zeros((len(group_masks), max_groups, num_words), np.uint64)
+    for i, masks in enumerate(group_masks):
+        for g, mask in enumerate(masks):
+            mask_array[i, g] = _split_mask(mask, num_words)
+    num_groups = np.array([len(masks) for masks in group_masks], np.int64)
+    num_subject_words = max((len(incompatible) + 63) // 64, 1)
+    incompatible_array = np.array([_split_mask(mask, num_subject_words) for mask in incompatible], np.uint64)
+    return mask_array, num_groups, incompatible_array.reshape(len(incompatible), num_subject_words), np.array(cred_hours, np.int64)
+
+def _split_mask(mask: int, num_words: int) -> list:
+    return [(mask >> (64 * word)) & 0xFFFFFFFFFFFFFFFF for word in range(num_words)]
+
+def _new_search_state(frontier: list, num_subjects: int, num_words: int, incompatible) -> tuple:
+    """
+    Makes the state arrays of _search_jit for searching below the nodes of a frontier of _search,
+    with one row per node in each of them:
+    position: The current subject index and the one of the node, the search is done once the first drops below the second.
+    occupied, blocked, partial_cred_hours, num_placed: On entering each level, the occupied periods (split into words),
+        the subjects incompatible with the included ones (as in incompatible), their credit hours and their number.
+    choice: The next option to try on each level, 0 for including, 1 for skipping, or -1 when just entered.
+    chosen: The groups of the included subjects on entering each level, as in _place_subject.
+    """
+    num_levels = num_subjects + 1
+    position = np.array([(node[0], node[0]) for node in frontier], np.int64).reshape(len(frontier), 2)
+    occupied = np.zeros((len(frontier), num_levels, num_words), np.uint64)
+    blocked = np.zeros((len(frontier), num_levels, incompatible.shape[1]), np.uint64)
+    partial_cred_hours = np.zeros((len(frontier), num_levels), np.int64)
+    num_placed = np.zeros((len(frontier), num_levels), np.int64)
+    choice = np.full((len(frontier), num_levels), -1, np.int64)
+    chosen = np.full((len(frontier), num_levels, num_subjects), -1, np.int64)
+    for branch, (idx, node_occupied, node_cred_hours, placements) in enumerate(frontier):
+        occupied[branch, idx] = _split_mask(node_occupied, num_words)
+        partial_cred_hours[branch, idx] = node_cred_hours
+        num_placed[branch, idx] = len(placements)
+        for subject_idx, group_idx in placements:
+            chosen[branch, idx, subject_idx] = group_idx
+            blocked[branch, idx] |= incompatible[subject_idx]
+    return position, occupied, blocked, partial_cred_hours, num_placed, choice, chosen
+
+# a row of the out array of _search_jit as a solution of _search
+def _decode_solution(row) -> tuple:
+    return tuple((subject_idx, int(group_idx)) for subject_idx, group_idx in enumerate(row) if group_idx >= 0)
 
 def build_tables(
     all_available_subjects: list, # List of Subject objects
@@ -211,11 +745,15 @@ def build_tables(
     max_cred_hours: int,
     priority_subjects: list = None, # List of Subject objects
     num_tables_to_generate: int = 1,
+    max_workers: int = 1,
 ) -> list: # Returns a list of Table objects
     """
     Generates a list of valid Table objects based on specified criteria,
-    using a combinational approach for selecting subjects.
-    Instead of random shuffling, it systematically explores combinations of subjects.
+    using a depth-first search over the subjects.
+    For every subject the search either includes or skips it,
+    and backtracks as soon as a subject cannot be placed or a limit can't be met anymore.
+    Each set of subjects gives at most one table, with the subjects in the first groups that fit together;
+    tables with more of the earlier subjects come first.
 
     Args:
         all_available_subjects: A list of all Subject objects that can be included.
@@ -226,88 +764,147 @@ def build_tables(
         priority_subjects: An optional list of Subject objects to prioritize.
                            These subjects will always be included in the candidate set if possible.
         num_tables_to_generate: The desired number of valid tables to generate.
+        max_workers: The number of processes to split the search across, or of threads if numba is installed.
+                     With more than one processes, which tables are found first may depend on timing.
+                     Searches over fewer than _JIT_MIN_SUBJECTS subjects always run in a single process.
 
     Returns:
         A list of Table objects that satisfy all the given criteria.
     """
-    valid_tables = []
-
     # 1. Separate priority and non-priority subjects that are actually available
-    actual_priority_subjects = [s for s in (priority_subjects or []) if s in all_available_subjects]
-    non_priority_available_subjects = [s for s in all_available_subjects if s not in actual_priority_subjects]
-
-    # 2. Determine the range of how many non-priority subjects to add
-    num_priority_actual = len(actual_priority_subjects)
-    min_non_priority_to_add = max(0, min_subjects - num_priority_actual)
-    max_non_priority_to_add = max_subjects - num_priority_actual
-
-    # 3. Generate all candidate subject sets using combinations
-    all_candidate_subject_sets = []
-    for k in range(min_non_priority_to_add, max_non_priority_to_add + 1):
-        if k < 0: # Ensure k is non-negative
-            continue
-        for non_priority_combo in itertools.combinations(non_priority_available_subjects, k):
-            candidate_set = list(actual_priority_subjects) + list(non_priority_combo)
-            # Add only if the total number of subjects is within bounds
-            if min_subjects <= len(candidate_set) <= max_subjects:
-                all_candidate_subject_sets.append(candidate_set)
-
-    # 4. Iterate through each candidate set of subjects to try and build a table
-    # Sort candidate sets for deterministic testing order (optional, but good for debugging)
-    all_candidate_subject_sets.sort(key=lambda s_list: tuple(sorted(sub.name for sub in s_list)))
-
-
-    for candidate_subjects_set in all_candidate_subject_sets:
-        if len(valid_tables) >= num_tables_to_generate:
-            break # Stop if enough tables are generated
-
-        current_table = Table()
-        subjects_successfully_added = []
-        conflict_found_for_set = False # Flag to track if this specific set of subjects can be scheduled
-
-        # Sort subjects within the set for a deterministic order of scheduling attempt
-        subjects_to_schedule = sorted(candidate_subjects_set, key=lambda s: s.name)
-
-        for subject in subjects_to_schedule:
-            added_this_subject = False
-            # Iterate through groups in a deterministic order (e.g., sorted by name)
-            # No random shuffle here
-            deterministic_groups = sorted(subject.groups, key=lambda g: g.name)
-
-            for group in deterministic_groups:
-                try:
-                    # The add_subject method checks for conflicts before modifying the table.
-                    # If ScheduleError is raised, the table's state remains unchanged, allowing
-                    # us to try another group or declare the set unschedulable.
-                    current_table.add_subject(subject, group.name)
-                    subjects_successfully_added.append(subject)
-                    added_this_subject = True
-                    break # Subject successfully added with this group
-                except ScheduleError:
-                    continue # This group conflicted, try another for the same subject
-                except DuplicateSubjectError:
-                    # This should theoretically not happen if `candidate_subjects_set`
-                    # contains unique subjects, which `itertools.combinations` ensures.
-                    added_this_subject = True # Consider it added if already there
+    # subjects compare by identity, so sets of their ids replace the list scans;
+    # a subject listed more than once is only scheduled once
+    all_available_subjects = list({id(s): s for s in all_available_subjects}.values())
+    available_ids = set(map(id, all_available_subjects))
+    actual_priority_subjects = list({id(s): s for s in (priority_subjects or []) if id(s) in available_ids}.values())
+    priority_ids = set(map(id, actual_priority_subjects))
+    non_priority_available_subjects = [s for s in all_available_subjects if id(s) not in priority_ids]
+
+    # Iterate through the group names in a deterministic order (sorted by name, see Subject._group_options),
+    # leaving out the ones whose groups overlap (see _groups_mask) or that have a period past
+    # the end of a default-sized Table, they can never be placed
+    viable_groups = {id(s): tuple((groups, mask) for groups, mask in s._group_options
+                                  if mask is not None and not mask >> (12 * len(WEEK_DAYS)))
+                     for s in all_available_subjects}
+    # A priority subject takes the periods shared by all of its groups whichever group it gets,
+    # so non-priority groups using one of them can never be placed; drop them before the search,
+    # and with them the non-priority subjects that have no group left
+    priority_mask = 0
+    for s in actual_priority_subjects:
+        if viable_groups[id(s)]:
+            shared_mask = viable_groups[id(s)][0][1]
+            for _, mask in viable_groups[id(s)][1:]:
+                shared_mask &= mask
+            priority_mask |= shared_mask
+    if priority_mask:
+        for s in non_priority_available_subjects:
+            viable_groups[id(s)] = tuple(option for option in viable_groups[id(s)] if not option[1] & priority_mask)
+        non_priority_available_subjects = [s for s in non_priority_available_subjects if viable_groups[id(s)]]
+
+    # 2. Order the subjects for the search: priority subjects come first since they are always placed,
+    # and within each part the subjects with the fewest viable groups come first, so conflicts show up near the
+    # root of the search where they cut off the most work; names keep the order deterministic
+    subjects_to_schedule = (sorted(actual_priority_subjects, key=lambda s: (len(viable_groups[id(s)]), s.name))
+                            + sorted(non_priority_available_subjects, key=lambda s: (len(viable_groups[id(s)]), s.name)))
+    groups_to_try = [viable_groups[id(s)] for s in subjects_to_schedule]
+
+    # 3. Search the subjects depth-first, see _search; which subjects can't be placed together
+    # only depends on their groups, so it's worked out once for all branches of the search
+    group_masks = [[mask for _, mask in options] for options in groups_to_try]
+    search_args = (
+        group_masks,
+        _incompatible_subjects(group_masks),
+        [subject.cred_hours for subject in subjects_to_schedule],
+        len(actual_priority_subjects),
+        min_subjects, max_subjects, min_cred_hours, max_cred_hours,
+        num_tables_to_generate,
+    )
+    use_jit = njit is not None and len(subjects_to_schedule) >= _JIT_MIN_SUBJECTS
+    if max_workers <= 1 or len(subjects_to_schedule) < _JIT_MIN_SUBJECTS:
+        if use_jit:
+            # the solutions are taken out in chunks of at most _SEARCH_CHUNK_ROWS,
+            # so a large num_tables_to_generate doesn't need a buffer of that size
+            group_mask_array, num_groups, incompatible, cred_hours = _encode_search_args(*search_args[:3])
+            state = [array[0] for array in _new_search_state([(0, 0, 0, ())], len(subjects_to_schedule),
+                                                             group_mask_array.shape[2], incompatible)]
+            out = np.empty((max(min(num_tables_to_generate, _SEARCH_CHUNK_ROWS), 0), len(subjects_to_schedule)), np.int64)
+            found_total = np.zeros(1, np.int64)
+            solutions = []
+            while len(solutions) < num_tables_to_generate:
+                rows = min(num_tables_to_generate - len(solutions), _SEARCH_CHUNK_ROWS)
+                found = _search_jit(group_mask_array, num_groups, incompatible, cred_hours, *search_args[3:8],
+                                    out[:rows], found_total, 0, num_tables_to_generate, *state)
+                solutions += [_decode_solution(row) for row in out[:found]]
+                if found < rows:
                     break
-                except Exception as e:
-                    print(f"Unexpected error adding subject {subject.name} group {group.name}: {e}")
-                    conflict_found_for_set = True
-                    break # An unexpected error occurred, give up on this subject set
-
-            if not added_this_subject:
-                # If the current subject could not be added with any of its groups,
-                # then this entire `candidate_subjects_set` cannot form a valid table.
-                conflict_found_for_set = True
+        else:
+            solutions, _ = _search(*search_args)
+    else:
+        # split the top of the search tree into independent branches, going deeper
+        # until there are enough of them to keep every worker busy
+        split_depth = 0
+        while True:
+            split_depth += 1
+            solutions, frontier = _search(*search_args, split_depth=split_depth)
+            if (len(frontier) >= 4 * max_workers or not frontier
+                    or split_depth >= len(subjects_to_schedule) or len(solutions) >= num_tables_to_generate):
                 break
+        if use_jit:
+            # each branch is searched by a numba thread into its own rows of out, which together hold at most
+            # _SEARCH_CHUNK_ROWS solutions; the branches whose rows filled up before enough were found are
+            # searched further in the next round. Results are kept in branch order
+            group_mask_array, num_groups, incompatible, cred_hours = _encode_search_args(*search_args[:3])
+            state = _new_search_state(frontier, len(subjects_to_schedule), group_mask_array.shape[2], incompatible)
+            remaining = num_tables_to_generate - len(solutions)
+            rows = min(max(_SEARCH_CHUNK_ROWS // max(len(frontier), 1), 1), max(remaining, 0))
+            out = np.empty((len(frontier), rows, len(subjects_to_schedule)), np.int64)
+            found = np.zeros(len(frontier), np.int64)
+            found_total = np.zeros(len(frontier), np.int64)
+            done = np.zeros(len(frontier), np.bool_)
+            branch_solutions = [[] for _ in frontier]
+            num_threads = get_num_threads()
+            set_num_threads(min(max_workers, numba.config.NUMBA_NUM_THREADS))
+            try:
+                while True:
+                    # a branch is still needed if the branches before it haven't found enough together
+                    active = ~done & (np.cumsum(found_total) - found_total < remaining)
+                    if not active.any():
+                        break
+                    _search_jit_parallel(group_mask_array, num_groups, incompatible, cred_hours, *search_args[3:8],
+                                         out, found, active, found_total, remaining, *state)
+                    for branch in np.flatnonzero(active):
+                        branch_solutions[branch] += [_decode_solution(row) for row in out[branch, :found[branch]]]
+                        done[branch] = found[branch] < rows
+            finally:
+                set_num_threads(num_threads)
+            for branch in branch_solutions:
+                solutions += branch
+            solutions = solutions[:num_tables_to_generate]
+        else:
+            # each branch is searched in its own process; results are kept in branch order
+            branch_solutions = [[] for _ in frontier]
+            found = len(solutions)
+            found_counter = multiprocessing.Value('q', found)
+            with ProcessPoolExecutor(max_workers, initializer=_init_search_worker, initargs=(found_counter,)) as executor:
+                futures = {executor.submit(_search, *search_args, start=node): branch for branch, node in enumerate(frontier)}
+                for future in as_completed(futures):
+                    branch_solutions[futures[future]] = future.result()[0]
+                    found += len(branch_solutions[futures[future]])
+                    if found >= num_tables_to_generate:
+                        for other in futures:
+                            other.cancel()
+                        break
+            for branch in branch_solutions:
+                solutions += branch
+            solutions = solutions[:num_tables_to_generate]
 
-        if not conflict_found_for_set:
-            # If all subjects in the candidate_subjects_set were successfully added,
-            # now check if the total credit hours meet the criteria.
-            current_cred_hours = current_table.get_cred_hours()
-
-            if (min_cred_hours <= current_cred_hours <= max_cred_hours):
-                valid_tables.append(current_table)
+    # 4. Only accepted tables are built as Table objects
+    valid_tables = []
+    for solution in solutions:
+        table = Table()
+        for subject_idx, group_idx in solution:
+            table._add_subject_fast(subjects_to_schedule[subject_idx], groups_to_try[subject_idx][group_idx][0])
+        valid_tables.append(table)
 
     if len(valid_tables) < num_tables_to_generate:
         print(f"Warning: Could only generate {len(valid_tables)} out of {num_tables_to_generate} requested tables after checking all viable combinations.")
@@ -316,6 +913,53 @@ def build_tables(
 
 from PIL import Image, ImageDraw, ImageFont
 import os
+from itertools import groupby
+from functools import lru_cache
+
+# try multiple paths before falling back to default
+_FONT_PATHS = [
+    "/usr/share/fonts/truetype/msttcorefonts/Arial.ttf", # Common on Linux
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",  # Often available
+    "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf", # Another common one
+]
+
+# the regular and small fonts for visualize_timetable and the path they were loaded from,
+# cached so that drawing many timetables doesn't parse the font files every time
+@lru_cache(maxsize=8)
+def _load_fonts(size: int, small_size: int) -> tuple:
+    for path in _FONT_PATHS:
+        try:
+            # Stop at the first successful font load
+            return ImageFont.truetype(path, size), ImageFont.truetype(path, small_size), path
+        except IOError:
+            continue
+    # default in case no TrueType font is found
+    return ImageFont.load_default(), ImageFont.load_default(), None
+
+# Function to wrap text (as per instruction 2), text_size gives the (width, height) of a line
+def _wrap_text(text, max_width, text_size):
+    lines = []
+    current_line = []
+    words = text.replace('\n', ' \n ').split(' ')
+
+    for word in words:
+        if word == '\n': # Handle explicit newlines
+            lines.append(" ".join(current_line))
+            current_line = []
+            continue
+
+        test_line = " ".join(current_line + [word])
+        text_width = text_size(test_line)[0]
+
+        if text_width <= max_width:
+            current_line.append(word)
+        else:
+            if current_line:
+                lines.append(" ".join(current_line))
+            current_line = [word]
+    if current_line:
+        lines.append(" ".join(current_line))
+    return lines
 
 def visualize_timetable(table: Table, filename: str = 'timetable.png'):
     """
@@ -352,43 +996,33 @@ def visualize_timetable(table: Table, filename: str = 'timetable.png'):
     image = Image.new('RGB', (img_width, img_height), BACKGROUND_COLOR)
     draw = ImageDraw.Draw(image)
 
-    # Load font - try multiple paths before falling back to default
-    font_paths = [
-        "/usr/share/fonts/truetype/msttcorefonts/Arial.ttf", # Common on Linux
-        "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",  # Often available
-        "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf", # Another common one
-    ]
-
     # Base font sizes (will be scaled by RESOLUTION_FACTOR)
     base_font_size = 18
     base_font_small_size = 14
 
-    font = ImageFont.load_default() # Initialize with default in case no TrueType font is found
-    font_small = ImageFont.load_default()
-    true_type_font_loaded = False
-
-    for path in font_paths:
-        try:
-            font = ImageFont.truetype(path, base_font_size * RESOLUTION_FACTOR)
-            font_small = ImageFont.truetype(path, base_font_small_size * RESOLUTION_FACTOR)
-            true_type_font_loaded = True
-            print(f"Successfully loaded font from {path}")
-            break # Stop at the first successful font load
-        except IOError:
-            continue
-
-    if not true_type_font_loaded:
+    # Load font - the fonts are only read from disk on the first call, see _load_fonts
+    font, font_small, font_path = _load_fonts(base_font_size * RESOLUTION_FACTOR, base_font_small_size * RESOLUTION_FACTOR)
+    if font_path is not None:
+        print(f"Successfully loaded font from {font_path}")
+    else:
         print("Warning: No TrueType font found from common paths. Using default bitmap font. Text size might be smaller than intended.")
 
-    # Draw grid lines
+    # Draw grid lines, one polyline per axis: it runs along each grid line in turn, alternating direction,
+    # so the pieces joining two lines lie on the outer border of the grid that is drawn anyway
+    grid_left, grid_right = SIDE_BAR_WIDTH + MARGIN, img_width - MARGIN
+    grid_top, grid_bottom = HEADER_HEIGHT + MARGIN, img_height - MARGIN
     # Vertical lines (for periods)
+    points = []
     for i in range(max_periods + 1):
         x = SIDE_BAR_WIDTH + i * CELL_WIDTH + MARGIN
-        draw.line([(x, HEADER_HEIGHT + MARGIN), (x, img_height - MARGIN)], fill=GRID_COLOR, width=1)
+        points += [(x, grid_top), (x, grid_bottom)] if i % 2 == 0 else [(x, grid_bottom), (x, grid_top)]
+    draw.line(points, fill=GRID_COLOR, width=1)
     # Horizontal lines (for days)
+    points = []
     for i in range(num_days + 1):
         y = HEADER_HEIGHT + i * CELL_HEIGHT + MARGIN
-        draw.line([(SIDE_BAR_WIDTH + MARGIN, y), (img_width - MARGIN, y)], fill=GRID_COLOR, width=1)
+        points += [(grid_left, y), (grid_right, y)] if i % 2 == 0 else [(grid_right, y), (grid_left, y)]
+    draw.line(points, fill=GRID_COLOR, width=1)
 
     # Draw period labels (headers - P1 to P12)
     for i in range(max_periods): # i from 0 to 11
@@ -419,42 +1053,33 @@ def visualize_timetable(table: Table, filename: str = 'timetable.png'):
     # --- Detect Merged Events --- (from previous step)
     merged_events = {}
 
-    for day_idx, day_abbr in enumerate(WEEK_DAYS):
-        day_schedule = table[day_abbr]
-        merged_events[day_abbr] = []
-        period_ptr = 0
-
-        while period_ptr < max_periods:
-            current_item = day_schedule[period_ptr]
-
-            if current_item is not None:
-                subject_obj, group_name, event_name = current_item
-                start_period = period_ptr
-                end_period = period_ptr
-
-                # Check for consecutive identical events
-                next_period_ptr = period_ptr + 1
-                while next_period_ptr < max_periods:
-                    next_item = day_schedule[next_period_ptr]
-                    if next_item is not None and \
-                       next_item[0].name == subject_obj.name and \
-                       next_item[1] == group_name and \
-                       next_item[2] == event_name:
-                        end_period = next_period_ptr
-                        next_period_ptr += 1
-                    else:
-                        break
+    # cells are grouped by the subject name, group and event they hold, empty cells by None
+    def cell_key(cell):
+        item = cell[1]
+        return None if item is None else (item[0].name, item[1], item[2])
 
-                merged_events[day_abbr].append({
-                    'subject': subject_obj,
-                    'group': group_name,
-                    'event': event_name,
-                    'start_period': start_period,
-                    'end_period': end_period
-                })
-                period_ptr = end_period + 1 # Move pointer past the merged block
-            else:
-                period_ptr += 1 # Move to the next period if current is empty
+    for day_abbr in WEEK_DAYS:
+        merged_events[day_abbr] = []
+        # each run of consecutive identical events becomes one merged block
+        for key, run in groupby(enumerate(table[day_abbr][:max_periods]), key=cell_key):
+            if key is None:
+                continue
+            run = list(run)
+            start_period, (subject_obj, group_name, event_name) = run[0]
+            merged_events[day_abbr].append({
+                'subject': subject_obj,
+                'group': group_name,
+                'event': event_name,
+                'start_period': start_period,
+                'end_period': run[-1][0]
+            })
+
+    # the (width, height) of a text in font_small; the same lines and line candidates
+    # come up again for every event of a subject, so each is measured only once
+    @lru_cache(maxsize=None)
+    def small_text_size(text):
+        bbox = draw.textbbox((0, 0), text, font=font_small)
+        return bbox[2] - bbox[0], bbox[3] - bbox[1]
 
     # --- Draw Merged Cells (and text within them) --- (updated for text wrapping and centering)
     for day_idx, day_abbr in enumerate(WEEK_DAYS):
@@ -481,39 +1106,12 @@ def visualize_timetable(table: Table, filename: str = 'timetable.png'):
             cell_inner_width = (x2 - x1) - 2 * event_padding
             cell_inner_height = (y2 - y1) - 2 * event_padding
 
-            # Function to wrap text (as per instruction 2)
-            def wrap_text(text, font, max_width, draw_obj):
-                lines = []
-                current_line = []
-                words = text.replace('\n', ' \n ').split(' ')
-
-                for word in words:
-                    if word == '\n': # Handle explicit newlines
-                        lines.append(" ".join(current_line))
-                        current_line = []
-                        continue
-
-                    test_line = " ".join(current_line + [word])
-                    bbox = draw_obj.textbbox((0, 0), test_line, font=font)
-                    text_width = bbox[2] - bbox[0]
-
-                    if text_width <= max_width:
-                        current_line.append(word)
-                    else:
-                        if current_line:
-                            lines.append(" ".join(current_line))
-                        current_line = [word]
-                if current_line:
-                    lines.append(" ".join(current_line))
-                return lines
-
-            wrapped_lines = wrap_text(event_text, font_small, cell_inner_width, draw) # Instruction 4
+            wrapped_lines = _wrap_text(event_text, cell_inner_width, small_text_size) # Instruction 4
 
             # Calculate total height of wrapped text block (Instruction 5)
             total_text_height = 0
             for line in wrapped_lines:
-                bbox = draw.textbbox((0, 0), line, font=font_small)
-                total_text_height += (bbox[3] - bbox[1])
+                total_text_height += small_text_size(line)[1]
             # Add line spacing
             total_text_height += (len(wrapped_lines) - 1) * (2 * RESOLUTION_FACTOR)
 
@@ -521,9 +1119,7 @@ def visualize_timetable(table: Table, filename: str = 'timetable.png'):
             current_y = y1 + event_padding + (cell_inner_height - total_text_height) / 2
 
             for line in wrapped_lines: # Instruction 7
-                bbox = draw.textbbox((0, 0), line, font=font_small)
-                text_width = bbox[2] - bbox[0]
-                text_height = bbox[3] - bbox[1]
+                text_width, text_height = small_text_size(line)
 
                 # Horizontal centering (Instruction 7b)
                 draw.text(